@@ -1,12 +1,43 @@
-import subprocess
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
+# Directories never descended into while collecting tracks
+PRUNE = {"backups", "wiki", "music"}
+
+
+def combine(raw_folder: str, output_folder: str, workers: int = 8) -> int:
+    """
+    Copy every .mp3 under `raw_folder` flat into `output_folder` (like `cp -n`: never overwrite).
+    - One os.walk, pruning PRUNE dirs and the output folder itself.
+    - Names are deduped case-insensitively, so this holds on case-insensitive volumes too.
+    - Copies are I/O-bound, so they run on a thread pool. Returns the number of files copied.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    out_abs = os.path.abspath(output_folder)
+
+    jobs = []
+    seen = set()
+    for root, dirs, files in os.walk(raw_folder):
+        dirs[:] = [d for d in dirs
+                   if d not in PRUNE and os.path.abspath(os.path.join(root, d)) != out_abs]
+        for f in files:
+            # first file with a given name wins, as with cp -n; compare case-folded
+            # so "Song.mp3" and "song.mp3" can't clobber each other on
+            # case-insensitive volumes (macOS/Windows defaults)
+            name = f.lower()
+            if name.endswith(".mp3") and name not in seen:
+                seen.add(name)
+                dst = os.path.join(output_folder, f)
+                if not os.path.exists(dst):
+                    jobs.append((os.path.join(root, f), dst))
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        for _ in ex.map(lambda job: shutil.copy2(*job), jobs):
+            pass
+    return len(jobs)
 
-def combine(raw_folder, output_folder):
-    subprocess.run(["sudo cd /Volumes/Elements 1"])
-    subprocess.run([f"sudo mkdir {output_folder}"])
-    subprocess.run(["sudo", "find", raw_folder,  ""])
-    subprocess.run([f"sudo cd {output_folder}"])
-    subprocess.run(["find . -type f ! -iname -type d \( -name backups -o -name wiki -o -name music \) -prune -false -o -type f -exec cp -nv '{}' music/ \;\"*.mp3\" -delete"])
 
 if __name__ == "__main__":
-    combine("music_raw", "music")
+    n = combine("music_raw", "music")
+    print(f"Copied {n} files into music/")
@@ -13,23 +13,45 @@ This script:
 - Resolves the real audio path from (Directory, SourceFile) or (Directory, FileName).
 - Estimates BPM (tempo) and musical key (e.g., "C# minor") using librosa.
 - Only fills empty/missing Bpm/Key unless --force is used.
-- Parallelizes processing for speed.
+- Parallelizes processing for speed (or batches key detection on a GPU with --gpu).
+- Checkpoints each result to <output>.partial.csv and resumes from it after a crash.
 
 Dependencies:
-  pip install pandas numpy librosa soundfile audioread tqdm
+  pip install pandas numpy librosa soundfile soxr audioread tqdm
+Optional:
+  pip install essentia   # faster, octave-robust tempo (RhythmExtractor2013)
+  pip install numba      # JIT key matching
+  pip install torch nnAudio   # --gpu
 """
 import argparse
+import csv
 import math
 import os
 import sys
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 import librosa
+import soundfile as sf
+import soxr
+
+try:
+    # librosa >= 0.10
+    from librosa.feature.rhythm import tempo as _lr_tempo
+except ImportError:
+    # librosa < 0.10
+    _lr_tempo = librosa.beat.tempo
+
+# Essentia (if installed) replaces the librosa tempo path: faster, and its
+# multi-feature beat tracker already resolves most double/half-time errors.
+try:
+    from essentia.standard import RhythmExtractor2013
+except ImportError:
+    RhythmExtractor2013 = None
 
 # ---- Key detection utilities (Krumhansl-Schmuckler template matching) ---- #
 
@@ -38,74 +60,197 @@ PITCHES_SHARP = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"
 KK_MAJOR = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88], dtype=float)
 KK_MINOR = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17], dtype=float)
 
-def rotate(arr, n):
-    return np.roll(arr, n)
+# Circulant (12, 12) template banks: row i is the unit-norm profile rotated to tonic i
+KK_MAJOR_ROT = np.stack([np.roll(KK_MAJOR / np.linalg.norm(KK_MAJOR), i) for i in range(12)]).astype(np.float32)
+KK_MINOR_ROT = np.stack([np.roll(KK_MINOR / np.linalg.norm(KK_MINOR), i) for i in range(12)]).astype(np.float32)
+
+def _kk_key_np(chroma_mean, maj_rot, min_rot):
+    """(tonic_idx, mode_idx) with mode 0 = major, 1 = minor; NumPy fallback."""
+    x = chroma_mean / (np.linalg.norm(chroma_mean) + 1e-9)
+    # Scores for all 24 keys at once: [C..B major, C..B minor]
+    best = int(np.argmax(np.concatenate([maj_rot @ x, min_rot @ x])))
+    return best % 12, best // 12
+
+def _kk_key_loops(chroma_mean, maj_rot, min_rot):
+    """Same as _kk_key_np as straight loops; only worth it when compiled by Numba."""
+    nrm = 0.0
+    for j in range(12):
+        nrm += chroma_mean[j] * chroma_mean[j]
+    inv = 1.0 / (np.sqrt(nrm) + 1e-9)
+    best_score = -np.inf
+    best = 0
+    # major rows first, then minor, so ties resolve like the NumPy path
+    for k in range(24):
+        bank = maj_rot if k < 12 else min_rot
+        i = k % 12
+        score = 0.0
+        for j in range(12):
+            score += bank[i, j] * chroma_mean[j]
+        score *= inv
+        if score > best_score:
+            best_score = score
+            best = k
+    return best % 12, best // 12
+
+try:
+    import numba
+    # At 12x12 BLAS dispatch costs more than the math; compiled loops avoid it
+    kk_key = numba.njit(cache=True)(_kk_key_loops)
+except ImportError:
+    kk_key = _kk_key_np
 
 def chroma_key(chroma_mean: np.ndarray) -> Tuple[str, str]:
     """Return (tonic, mode) like ('C#', 'minor') given a 12-dim mean chroma."""
     if chroma_mean.ndim != 1 or chroma_mean.shape[0] != 12:
         raise ValueError("chroma_mean must be shape (12,)")
 
-    # Normalize inputs
-    x = chroma_mean / (np.linalg.norm(chroma_mean) + 1e-9)
-    maj = KK_MAJOR / np.linalg.norm(KK_MAJOR)
-    min_ = KK_MINOR / np.linalg.norm(KK_MINOR)
-
-    best_score = -np.inf
-    best = (0, "major")
-    for i in range(12):
-        s_maj = float(np.dot(x, rotate(maj, i)))
-        s_min = float(np.dot(x, rotate(min_, i)))
-        if s_maj > best_score:
-            best_score = s_maj
-            best = (i, "major")
-        if s_min > best_score:
-            best_score = s_min
-            best = (i, "minor")
-
-    tonic = PITCHES_SHARP[best[0] % 12]
-    return tonic, best[1]
+    tonic_idx, mode_idx = kk_key(np.ascontiguousarray(chroma_mean, dtype=np.float32), KK_MAJOR_ROT, KK_MINOR_ROT)
+    return PITCHES_SHARP[tonic_idx], ("major", "minor")[mode_idx]
 
 # ---- Audio analysis ---- #
 
+# Analysis runs at 11025 Hz: nothing BPM/chroma needs lives above ~5 kHz.
+# 1024/256 keeps the same window length (~93 ms) and frame rate (~43 Hz) as 2048/512 at 22050.
+ANALYSIS_SR = 11025
+N_FFT = 1024
+HOP_LENGTH = 256
+
+# Worker-local decode buffer, reused across files (see _init_worker)
+_SCRATCH: Optional[np.ndarray] = None
+
+def _init_worker(duration: float = 90.0) -> None:
+    """Process-pool initializer: preallocate the decode buffer once per worker."""
+    global _SCRATCH
+    # Room for a stereo 48 kHz slice; grown on demand for anything larger
+    _SCRATCH = np.empty(int(48000 * duration) * 2, dtype=np.float32)
+
+def _scratch(frames: int, channels: int) -> np.ndarray:
+    """Return a (frames, channels) C-contiguous view into the worker buffer."""
+    global _SCRATCH
+    n = frames * channels
+    if _SCRATCH is None or _SCRATCH.size < n:
+        _SCRATCH = np.empty(n, dtype=np.float32)
+    return _SCRATCH[:n].reshape(frames, channels)
+
+def decode_native(path: Path, duration: Optional[float] = None, offset: float = 0.0) -> Tuple[np.ndarray, int]:
+    """
+    Decode a slice of the file once at its native rate and mix to mono; returns (y, native_sr).
+    - soundfile seeks straight to the slice.
+    - Fixed-length slices decode into the worker's scratch buffer instead of a fresh array.
+    - Formats libsndfile can't open (m4a/aac, mp3 on libsndfile < 1.1) go through librosa/audioread.
+    """
+    try:
+        with sf.SoundFile(path.as_posix()) as f:
+            native_sr, channels = f.samplerate, f.channels
+            start = min(int(offset * native_sr), f.frames)
+            f.seek(start)
+            if duration is not None:
+                frames = min(int(duration * native_sr), f.frames - start)
+                y = f.read(dtype="float32", always_2d=True, out=_scratch(frames, channels))
+            else:
+                y = f.read(dtype="float32", always_2d=True)
+    except RuntimeError:  # sf.LibsndfileError subclasses RuntimeError
+        y, native_sr = librosa.load(path.as_posix(), sr=None, mono=True, offset=offset, duration=duration)
+        return np.ascontiguousarray(y, dtype=np.float32), native_sr
+    # Mono mixdown copies out of the scratch buffer
+    return y.mean(axis=1, dtype=np.float32), native_sr
+
+def resample(y: np.ndarray, native_sr: int, sr: int) -> np.ndarray:
+    """Resample to `sr` with soxr; 'QQ' is plenty for BPM/chroma."""
+    if native_sr != sr:
+        y = soxr.resample(y, native_sr, sr, quality="QQ")
+    return np.ascontiguousarray(y, dtype=np.float32)
+
+def load_audio(path: Path, sr: int, duration: Optional[float] = None, offset: float = 0.0) -> np.ndarray:
+    """Decode a slice of the file (see decode_native) and resample it to `sr`."""
+    y, native_sr = decode_native(path, duration=duration, offset=offset)
+    return resample(y, native_sr, sr)
+
+def _load_for_analysis(path: Path, sr: int, duration: float, offset: float,
+                       essentia: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Decode the analysis slice once (whole file if the slice is too short); returns (y at `sr`, y at ESSENTIA_SR).
+    - Each rate is resampled straight from the native-rate samples; the second is None unless `essentia`.
+    """
+    y, native_sr = decode_native(path, duration=duration, offset=offset)
+    if y.size < native_sr * 5:  # too little signal
+        # Try whole file short fallback
+        y, native_sr = decode_native(path)
+    y_ess = resample(y, native_sr, ESSENTIA_SR) if essentia else None
+    # No pre-emphasis: it attenuates the bass fundamentals the key profiles rely on
+    return resample(y, native_sr, sr), y_ess
+
+def _power_stft(y: np.ndarray) -> np.ndarray:
+    return np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+
+# One extractor per process: Essentia algorithms are not thread-safe, and this
+# only ever runs in the main process or a process-pool worker.
+_RHYTHM = None
+ESSENTIA_SR = 44100  # RhythmExtractor2013 assumes 44.1 kHz input
+
+def _essentia_bpm(y: np.ndarray) -> float:
+    """BPM of a mono float32 signal already at ESSENTIA_SR."""
+    global _RHYTHM
+    if _RHYTHM is None:
+        _RHYTHM = RhythmExtractor2013(method="multifeature")
+    bpm, _, _, _, _ = _RHYTHM(y)
+    return float(bpm)
+
+def _estimate_tempo(y: np.ndarray, sr: int, S: Optional[np.ndarray] = None,
+                    y_ess: Optional[np.ndarray] = None) -> Optional[float]:
+    """
+    Tempo folded into the 70–180 BPM window.
+    - Essentia RhythmExtractor2013 on `y_ess` (the ESSENTIA_SR slice) when given,
+      else librosa on the power spectrogram `S` of `y` (computed if None).
+    """
+    if y_ess is not None:
+        tempo = _essentia_bpm(y_ess)
+    else:
+        if S is None:
+            S = _power_stft(y)
+        # Onset envelope from the shared power spectrogram; aggregate mean tempo
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(S), sr=sr, hop_length=HOP_LENGTH)
+        tempo = _tempo(onset_env, sr)
+    if math.isnan(tempo) or tempo <= 0:
+        return None
+    # Normalize to typical dance range heuristic (unfold double/half-time)
+    # Bring into 70–180 BPM window; rarely triggers with Essentia
+    while tempo < 70:
+        tempo *= 2
+    while tempo > 180:
+        tempo /= 2
+    return round(float(tempo), 2)
+
 def estimate_bpm_and_key(
     path: Path,
-    sr: int = 22050,
+    sr: int = ANALYSIS_SR,
     duration: float = 90.0,
     offset: float = 15.0,
+    need_bpm: bool = True,
+    need_key: bool = True,
 ) -> Tuple[Optional[float], Optional[str]]:
     """
-    Load a slice of the audio and estimate BPM and Key.
+    Load a slice of the audio and estimate BPM and/or Key.
     - duration/offset chosen to skip cold intros and keep runtime down.
+    - One STFT feeds both the onset envelope (tempo) and the chroma (key); Essentia skips the former.
+    - A field that isn't needed is neither computed nor returned (None).
     """
     try:
-        y, sr = librosa.load(path.as_posix(), sr=sr, mono=True, offset=offset, duration=duration)
-        if y.size < sr * 5:  # too little signal
-            # Try whole file short fallback
-            y, sr = librosa.load(path.as_posix(), sr=sr, mono=True)
-
-        # Simple pre-emphasis / HP to reduce DC & rumble
-        y = librosa.effects.preemphasis(y)
+        y, y_ess = _load_for_analysis(path, sr, duration, offset,
+                                      essentia=need_bpm and RhythmExtractor2013 is not None)
+        # Shared by chroma and (without Essentia) tempo; tempo builds its own if key isn't needed
+        S = _power_stft(y) if need_key else None
 
         # BPM (tempo)
-        # Use beat tracker; aggregate mean tempo (librosa returns array)
-        tempo = _tempo(y, sr)
-        if math.isnan(tempo) or tempo <= 0:
-            tempo = None
-        else:
-            # Normalize to typical dance range heuristic (unfold double/half-time)
-            # Bring into 70–180 BPM window
-            while tempo < 70:
-                tempo *= 2
-            while tempo > 180:
-                tempo /= 2
-            tempo = round(float(tempo), 2)
-
-        # Key via mean CQT chroma
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        chroma_mean = chroma.mean(axis=1)
-        tonic, mode = chroma_key(chroma_mean)
-        key_str = f"{tonic} {mode}"
+        tempo = _estimate_tempo(y, sr, S, y_ess) if need_bpm else None
+
+        # Key via mean STFT chroma
+        key_str = None
+        if need_key:
+            chroma = librosa.feature.chroma_stft(S=S, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH)
+            chroma_mean = chroma.mean(axis=1)
+            tonic, mode = chroma_key(chroma_mean)
+            key_str = f"{tonic} {mode}"
 
         return tempo, key_str
     except Exception as e:
@@ -113,26 +258,147 @@ def estimate_bpm_and_key(
         print(f"[WARN] Failed to analyze {path}: {e}", file=sys.stderr)
         return None, None
 
-def analyze_item(idx: int, path_str: Optional[str], sr: int, duration: float, offset: float) -> Tuple[int, Optional[float], Optional[str]]:
+def analyze_item(idx: int, path_str: Optional[str], sr: int, duration: float, offset: float,
+                 need_bpm: bool = True, need_key: bool = True) -> Tuple[int, Optional[float], Optional[str]]:
     if not path_str:
         return idx, None, None
     path = Path(path_str)
-    if not (path.exists() and path.is_file()):
+    if not path.is_file():  # one stat; is_file() is False for missing paths
         return idx, None, None
-    tempo, key = estimate_bpm_and_key(path, sr=sr, duration=duration, offset=offset)
+    tempo, key = estimate_bpm_and_key(path, sr=sr, duration=duration, offset=offset,
+                                      need_bpm=need_bpm, need_key=need_key)
     return idx, tempo, key
-def _tempo(y, sr):
+def _analyze_chunk(chunk, sr: int, duration: float, offset: float):
+    """Analyze a batch of (idx, path, need_bpm, need_key) tasks inside one worker."""
+    return [analyze_item(idx, p, sr, duration, offset, nb, nk) for (idx, p, nb, nk) in chunk]
+
+def _tempo(onset_env, sr):
     """Version-safe tempo wrapper using a callable aggregate."""
-    try:
-        # librosa >= 0.10
-        from librosa.feature.rhythm import tempo as lr_tempo
-        t = lr_tempo(y=y, sr=sr, aggregate=np.mean)
-    except Exception:
-        # librosa < 0.10
-        t = librosa.beat.tempo(y=y, sr=sr, aggregate=np.mean)
+    t = _lr_tempo(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH, aggregate=np.mean)
     # librosa returns an array; take float
     return float(np.asarray(t).squeeze())
 
+# ---- GPU key detection (optional: pip install torch nnAudio) ---- #
+
+# C1 (32.7 Hz) lowest bin, 12 bins/octave over 7 octaves -> bin b is pitch class b % 12
+CQT_FMIN = 32.7
+CQT_BINS = 84
+
+def _gpu_device():
+    import torch
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return torch.device("mps")
+    raise RuntimeError("--gpu requested but neither CUDA nor MPS is available.")
+
+def _prepare_gpu_chunk(chunk, sr: int, duration: float, offset: float):
+    """
+    CPU side of --gpu for a batch of (idx, path, need_bpm, need_key) tasks: decode and tempo.
+    Returns (idx, tempo, key, y) per task; `y` is the signal still waiting for the GPU key pass, else None.
+    """
+    out = []
+    for idx, p, need_bpm, need_key in chunk:
+        if not p or not Path(p).is_file():
+            out.append((idx, None, None, None))
+        elif not need_key:
+            # BPM only: nothing to batch on the device
+            out.append((*analyze_item(idx, p, sr, duration, offset, need_bpm, need_key), None))
+        else:
+            try:
+                y, y_ess = _load_for_analysis(Path(p), sr, duration, offset,
+                                              essentia=need_bpm and RhythmExtractor2013 is not None)
+                out.append((idx, _estimate_tempo(y, sr, y_ess=y_ess) if need_bpm else None, None, y))
+            except Exception as e:
+                print(f"[WARN] Failed to analyze {p}: {e}", file=sys.stderr)
+                out.append((idx, None, None, None))
+    return out
+
+def _pool_imap(fn, chunks, workers: int, duration: float, *args):
+    """
+    Yield fn(chunk, *args) for each chunk from a process pool, in completion order.
+    - Spawned workers: forking a parent that has CUDA/MPS initialized is unsafe.
+    - At most 2 chunks per worker in flight, so decoded audio can't pile up faster than the GPU drains it.
+    """
+    import multiprocessing as mp
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    chunks = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(duration,)) as ex:
+        running = {ex.submit(fn, c, *args) for _, c in zip(range(workers * 2), chunks)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                yield f.result()
+                nxt = next(chunks, None)
+                if nxt is not None:
+                    running.add(ex.submit(fn, nxt, *args))
+
+def analyze_gpu(tasks, sr: int, duration: float, offset: float, batch_size: int = 32, workers: int = 1):
+    """
+    Yield (idx, tempo, key) for each (idx, path, need_bpm, need_key) task, batching the CQT chroma and KK match on the GPU.
+    - Decode and tempo stay on the CPU, in a `workers`-process pool as without --gpu; only the key path runs on the device.
+    """
+    try:
+        import torch
+        from nnAudio.features import CQT
+    except ImportError:
+        raise SystemExit("--gpu needs torch and nnAudio (pip install torch nnAudio).")
+
+    device = _gpu_device()
+    cqt = CQT(sr=sr, hop_length=HOP_LENGTH, fmin=CQT_FMIN, n_bins=CQT_BINS, bins_per_octave=12,
+              output_format="Magnitude", verbose=False).to(device)
+    # (84, 12) fold of CQT bins onto pitch classes
+    fold = np.zeros((CQT_BINS, 12), dtype=np.float32)
+    fold[np.arange(CQT_BINS), np.arange(CQT_BINS) % 12] = 1.0
+    fold = torch.from_numpy(fold).to(device)
+    # (24, 12) bank: [C..B major, C..B minor]
+    kk_bank = torch.from_numpy(np.concatenate([KK_MAJOR_ROT, KK_MINOR_ROT])).to(device)
+
+    def gpu_keys(ys):
+        """Key strings for a batch of signals (all None if the batch fails)."""
+        try:
+            # Zero padding only adds silent frames, which do not move the argmax
+            batch = np.zeros((len(ys), max(y.size for y in ys)), dtype=np.float32)
+            for j, y in enumerate(ys):
+                batch[j, :y.size] = y
+            with torch.no_grad():
+                C = cqt(torch.from_numpy(batch).to(device)).abs()         # (N, 84, T)
+                chroma = torch.einsum("nbt,bc->nct", C, fold)             # (N, 12, T)
+                chroma = chroma / (chroma.amax(dim=1, keepdim=True) + 1e-9)
+                x = chroma.mean(dim=2)                                    # (N, 12)
+                x = x / (x.norm(dim=1, keepdim=True) + 1e-9)
+                best = (x @ kk_bank.T).argmax(dim=1).cpu().numpy()       # (N,)
+        except Exception as e:
+            print(f"[WARN] GPU key batch failed: {e}", file=sys.stderr)
+            return [None] * len(ys)
+        return [f"{PITCHES_SHARP[b % 12]} {'major' if b < 12 else 'minor'}" for b in best.tolist()]
+
+    size = min(CHUNK_SIZE, batch_size)
+    chunks = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+    if workers and workers > 1:
+        prepared = _pool_imap(_prepare_gpu_chunk, chunks, workers, duration, sr, duration, offset)
+    else:
+        _init_worker(duration)
+        prepared = (_prepare_gpu_chunk(chunk, sr, duration, offset) for chunk in chunks)
+
+    # (idx, tempo, y) collected from however many chunks it takes to fill a device batch
+    pending = []
+    for res in prepared:
+        for idx, tempo, key, y in res:
+            if y is None:
+                yield idx, tempo, key
+            else:
+                pending.append((idx, tempo, y))
+        while len(pending) >= batch_size:
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            for (idx, tempo, _), key in zip(batch, gpu_keys([y for _, _, y in batch])):
+                yield idx, tempo, key
+    if pending:
+        for (idx, tempo, _), key in zip(pending, gpu_keys([y for _, _, y in pending])):
+            yield idx, tempo, key
+
 # ---- Path resolution ---- #
 
 def semicolon_path_to_real(base_dir: Path, token_path: str) -> Path:
@@ -151,7 +417,44 @@ def _strip_dot_slash(s: str) -> str:
     s = s.strip()
     return s[2:] if s.startswith("./") else s
 
-def find_audio_path(row) -> Optional[Path]:
+def _iter_files(directory: str):
+    """Yield (name, path) for every file under `directory`, via os.scandir recursion (no Path objects)."""
+    try:
+        it = os.scandir(directory)
+    except OSError:
+        return
+    subdirs = []
+    with it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    yield entry.name, entry.path
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+            except OSError:
+                continue
+    # files of a directory before its subdirectories, like os.walk top-down
+    for d in subdirs:
+        yield from _iter_files(d)
+
+def build_basename_index(directory: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Walk `directory` once; return (exact, lowercased) basename -> path maps.
+    - First hit wins, files before subdirectories at each level.
+    - Kept separate so a case-insensitive match never shadows an exact one.
+    """
+    exact: Dict[str, str] = {}
+    lower: Dict[str, str] = {}
+    for name, p in _iter_files(directory):
+        exact.setdefault(name, p)
+        lower.setdefault(name.lower(), p)
+    return exact, lower
+
+def find_audio_path(row, basename_index: Dict[str, Tuple[Dict[str, str], Dict[str, str]]]) -> Optional[Path]:
+    """
+    Resolve the audio file for a CSV row.
+    - `basename_index` caches one build_basename_index() per Directory, filled on first miss.
+    """
     directory = str(row.get("Directory", "") or "").strip()
     source_file = str(row.get("SourceFile", "") or "").strip()
     file_name   = str(row.get("FileName", "")   or "").strip()
@@ -159,8 +462,6 @@ def find_audio_path(row) -> Optional[Path]:
     if not directory:
         return None
 
-    base = Path(directory)
-
     # candidates in priority order; DO NOT replace ';'
     cand_strings = []
     if source_file:
@@ -170,17 +471,14 @@ def find_audio_path(row) -> Optional[Path]:
         fn = _strip_dot_slash(file_name)
         cand_strings += [fn, os.path.basename(fn)]
 
-    # de-dup while preserving order
+    # de-dup while preserving order; one stat per candidate and no realpath walk
     seen = set()
-    cands = []
     for s in cand_strings:
         if s and s not in seen:
             seen.add(s)
-            cands.append((base / s).resolve())
-
-    for c in cands:
-        if c.exists() and c.is_file():
-            return c
+            c = os.path.join(directory, s)
+            if os.path.isfile(c):
+                return Path(os.path.abspath(c))
 
     # fallback: search by basename
     basename = None
@@ -190,15 +488,47 @@ def find_audio_path(row) -> Optional[Path]:
         basename = os.path.basename(source_file)
 
     if basename:
-        try:
-            for p in base.rglob(basename):
-                if p.is_file():
-                    return p.resolve()
-        except Exception:
-            pass
+        if directory not in basename_index:
+            basename_index[directory] = build_basename_index(directory)
+        exact, lower = basename_index[directory]
+        hit = exact.get(basename) or lower.get(basename.lower())
+        if hit:
+            return Path(os.path.abspath(hit))
 
     return None
 
+# ---- Checkpointing ---- #
+
+CHECKPOINT_HEADER = ["idx", "bpm", "key"]
+# Max tasks per pool chunk; results are checkpointed as each chunk finishes
+CHUNK_SIZE = 32
+
+def checkpoint_path(out_csv: str) -> str:
+    """Sidecar for `out_csv`, e.g. tags_updated.csv -> tags_updated.partial.csv."""
+    root, ext = os.path.splitext(out_csv)
+    return f"{root}.partial{ext or '.csv'}"
+
+def load_checkpoint(path: str):
+    """
+    Return the (idx, tempo, key) rows already written to `path` ([] if none).
+    A half-written last line (crash mid-write) is truncated away, so appending resumes on a clean line.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].decode().splitlines(keepends=True)
+    done = []
+    for rec in csv.reader(lines[1:]):
+        if len(rec) != 3:
+            continue
+        idx, bpm, key = rec
+        done.append((int(idx), float(bpm) if bpm else None, key or None))
+    return done
+
 # ---- Main ---- #
 
 def main():
@@ -207,8 +537,10 @@ def main():
     ap.add_argument("--force", action="store_true", help="Recompute BPM/Key even if already present.")
     ap.add_argument("--duration", type=float, default=90.0, help="Analysis duration in seconds (default: 90).")
     ap.add_argument("--offset", type=float, default=15.0, help="Start offset in seconds (default: 15).")
-    ap.add_argument("--sr", type=int, default=22050, help="Target sample rate (default: 22050).")
+    ap.add_argument("--sr", type=int, default=ANALYSIS_SR, help=f"Target sample rate (default: {ANALYSIS_SR}).")
     ap.add_argument("--workers", type=int, default=10, help="Parallel workers (0/1 = single-thread).")
+    ap.add_argument("--gpu", action="store_true", help="Batch key detection on CUDA/MPS via nnAudio; decode still uses --workers.")
+    ap.add_argument("--batch-size", type=int, default=32, help="Files per GPU batch with --gpu (default: 32).")
     args = ap.parse_args()
 
     df = pd.read_csv("tags.csv")
@@ -224,52 +556,95 @@ def main():
         df["Key"] = ""
 
     # Row indices to process
-    to_process = []
-    for idx, row in df.iterrows():
-        bpm_empty = (args.force or pd.isna(row.get("Bpm")) or str(row.get("Bpm")).strip() in ("", "nan", "None", "0"))
-        key_empty = (args.force or not str(row.get("Key", "")).strip())
-        if bpm_empty or key_empty:
-            to_process.append(idx)
-
-    if not to_process:
+    if args.force:
+        bpm_empty = np.ones(len(df), dtype=bool)
+        key_empty = bpm_empty
+    else:
+        bpm_empty = (df["Bpm"].isna() | df["Bpm"].astype(str).str.strip().isin(["", "nan", "None", "0"])).to_numpy()
+        key_empty = df["Key"].fillna("").astype(str).str.strip().eq("").to_numpy()
+    pos = np.flatnonzero(bpm_empty | key_empty)
+    to_process = df.index[pos].to_numpy()
+
+    # Resume: rows already in the checkpoint are not analyzed again
+    out = args.output_csv or args.input_csv
+    partial = checkpoint_path(out)
+    done = load_checkpoint(partial)
+    stale = np.setdiff1d([d[0] for d in done], df.index.to_numpy())
+    if stale.size:
+        # written against a different tags.csv: its indices would land on the wrong rows
+        print(f"Warning: {partial} has {stale.size} rows not in tags.csv; discarding it and starting over",
+              file=sys.stderr)
+        os.remove(partial)
+        done = []
+    if done:
+        keep = ~np.isin(to_process, [d[0] for d in done])
+        pos, to_process = pos[keep], to_process[keep]
+        print(f"Resuming from {partial}: {len(done)} rows already done")
+
+    if not len(to_process) and not done:
         print("Nothing to do. All rows have BPM and Key (use --force to recompute).")
         return
     print("Processing task")
-    tasks = []
-    for idx in to_process:
-        row = df.loc[idx]
-        audio_path = find_audio_path(row)
-        tasks.append((idx, audio_path))
-        print(f"Finished {idx}")
-
-    # Worker function
-    def work(item):
-        idx, path = item
-        if path is None:
-            return idx, None, None
-        tempo, key = estimate_bpm_and_key(path, sr=args.sr, duration=args.duration, offset=args.offset)
-        return idx, tempo, key
-
-    results = []
-    if args.workers and args.workers > 1:
-        from concurrent.futures import ProcessPoolExecutor, as_completed
-        with ProcessPoolExecutor(max_workers=args.workers) as ex:
-            futs = [ex.submit(analyze_item, idx, p, args.sr, args.duration, args.offset) for (idx, p) in tasks]
-            for f in tqdm(as_completed(futs), total=len(futs), desc="Analyzing"):
-                results.append(f.result())
-    else:
-        for (idx, p) in tqdm(tasks, desc="Analyzing", total=len(tasks)):
-            results.append(analyze_item(idx, p, args.sr, args.duration, args.offset))
+    rows = df.loc[to_process].to_dict(orient="records")
+    basename_index: Dict[str, Tuple[Dict[str, str], Dict[str, str]]] = {}
+    # (idx, path, need_bpm, need_key): workers only compute the missing fields
+    tasks = [(idx, find_audio_path(row, basename_index), bool(nb), bool(nk))
+             for idx, row, nb, nk in zip(to_process, rows, bpm_empty[pos], key_empty[pos])]
+
+    results = list(done)
+    # Line-buffered append: every finished row hits the checkpoint immediately
+    with open(partial, "a", newline="", buffering=1) as ckpt:
+        writer = csv.writer(ckpt)
+        if ckpt.tell() == 0:
+            writer.writerow(CHECKPOINT_HEADER)
+
+        def record(res):
+            results.extend(res)
+            writer.writerows(res)
+
+        if args.gpu:
+            for r in tqdm(analyze_gpu(tasks, args.sr, args.duration, args.offset, args.batch_size, args.workers),
+                          total=len(tasks), desc="Analyzing (gpu)"):
+                record([r])
+        elif args.workers and args.workers > 1:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            # ~4 chunks per worker: amortizes per-task overhead but still balances load;
+            # capped so a crash loses at most CHUNK_SIZE unsaved rows per worker
+            size = min(CHUNK_SIZE, max(1, math.ceil(len(tasks) / (args.workers * 4))))
+            chunks = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(args.duration,)) as ex:
+                futs = [ex.submit(_analyze_chunk, chunk, args.sr, args.duration, args.offset) for chunk in chunks]
+                with tqdm(total=len(tasks), desc="Analyzing") as bar:
+                    for f in as_completed(futs):
+                        res = f.result()
+                        record(res)
+                        bar.update(len(res))
+        else:
+            _init_worker(args.duration)
+            for (idx, p, nb, nk) in tqdm(tasks, desc="Analyzing", total=len(tasks)):
+                record([analyze_item(idx, p, args.sr, args.duration, args.offset, nb, nk)])
     print("Applying results")
-    # Apply results
-    for idx, tempo, key in results:
-        if tempo is not None:
-            df.at[idx, "Bpm"] = tempo
-        if key is not None:
-            df.at[idx, "Key"] = key
-
-    out = args.output_csv or args.input_csv
-    df.to_csv(out, index=False)
+    # Apply results: scatter into full-length columns, then one bulk assignment each
+    tempos = np.full(len(df), np.nan)
+    keys = np.full(len(df), None, dtype=object)
+    if results:
+        idxs, res_tempos, res_keys = zip(*results)
+        pos = df.index.get_indexer(list(idxs))
+        ok = pos >= 0  # -1 = index not in df; never let it wrap onto the last row
+        tempos[pos[ok]] = np.array([np.nan if t is None else t for t in res_tempos])[ok]
+        keys[pos[ok]] = np.array(res_keys, dtype=object)[ok]
+    has_bpm = ~np.isnan(tempos)
+    has_key = pd.notna(keys)
+    if df["Key"].dtype != object:
+        df["Key"] = df["Key"].astype(object)
+    df.loc[has_bpm, "Bpm"] = tempos[has_bpm]
+    df.loc[has_key, "Key"] = keys[has_key]
+
+    # Write next to the target and rename, so a crash never leaves a truncated CSV
+    tmp = out + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, out)
+    os.remove(partial)
     print(f"Done. Wrote {out}")
 
 if __name__ == "__main__":
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
-import argparse, os, re, json, sys
-from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Tuple, Optional
+import argparse, os, re, json, pickle, sys
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Tuple, Optional
 
 # Use orjson if installed (faster); fall back to stdlib json
 try:
@@ -22,20 +26,83 @@ except Exception:
     def jdumps(o):
         return json.dumps(o).encode()
 
+# zstandard (if installed) compresses the pickled index; plain pickle otherwise
+try:
+    import zstandard as _zstd
+except Exception:
+    _zstd = None
+# Frame magic, so either kind of index file can be loaded
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+import numpy as np
 from rapidfuzz import process, fuzz
 
 FIELDS = ["title", "artist", "album", "key", "bpm", "path"]
+# Below this many songs a full RapidFuzz scan is fast enough and the trigram
+# prefilter only costs recall (typos and short queries share few trigrams)
+TRIGRAM_MIN_SONGS = 20000
+# Bumped whenever the pickled index layout changes
+INDEX_FORMAT = 4
 
 
 # ---------- Normalization ----------
+# strip punctuation commonly found in song titles, then collapse whitespace
+_PUNCT = re.compile(r"[^\w\s+#/.-]", re.UNICODE)
+_WS = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
 def norm(s: str) -> str:
     if s is None: return ""
-    s = str(s)
-    s = s.lower()
-    # collapse whitespace, strip punctuation commonly found in song titles
-    s = re.sub(r"[^\w\s+#/.-]", " ", s, flags=re.UNICODE)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    # interned: repeated artists/albums share one string object across the corpus
+    return sys.intern(_WS.sub(" ", _PUNCT.sub(" ", str(s).lower())).strip())
+
+
+# Query tokens in one alternation: bpm range | key:<tonic> major/minor | field:value | 'exact phrase'
+# field values are one word; quote multi-word ones (artist:'taylor swift')
+_QRE = re.compile(
+    r"(?P<bpmr>\bbpm\s*:\s*(?P<lo>\d+)\s*\.\.\s*(?P<hi>\d+))"
+    r"|(?P<kv>\bkey\s*:\s*(?P<kval>[a-g][#b]?\s+(?:major|minor))\b)"
+    r"|(?P<fv>\b(?P<f>title|artist|album|key|bpm)\s*:\s*(?P<v>[^\s']+|'[^']*'))"
+    r"|(?P<ph>'(?P<phr>[^']+)')",
+    re.I,
+)
+
+
+# Simple query language: field:value, bpm:lo..hi, quoted phrases
+@lru_cache(maxsize=4096)
+def parse_query(query: str) -> Tuple[str, Optional[str], Mapping[str, Any]]:
+    """Split a query into (free text, phrase, filters). Cached, so filters come back read-only."""
+    filters = {}
+    phrase = None
+    free = []
+    pos = 0
+    # one scan over the query; everything outside a match is free text
+    for m in _QRE.finditer(query):
+        free.append(query[pos:m.start()])
+        pos = m.end()
+        if m.group("bpmr"):
+            # bpm range e.g. bpm:120..130 (first one wins)
+            filters.setdefault("bpm_range", (int(m.group("lo")), int(m.group("hi"))))
+        elif m.group("kv"):
+            # unquoted "key:a minor" is common enough to allow
+            filters["key"] = norm(m.group("kval"))
+        elif m.group("fv"):
+            # field:value pairs (artist:, title:, album:, key:, bpm:)
+            f, v = m.group("f").lower(), m.group("v")
+            if v.startswith("'") and v.endswith("'"): v = v[1:-1]
+            filters[f] = norm(v) if f != "bpm" else v
+        elif phrase is None:
+            # exact phrase: 'once in a lifetime'
+            phrase = norm(m.group("phr"))
+    free.append(query[pos:])
+
+    query = norm("".join(free))
+    return query, phrase, MappingProxyType(filters)
+
+
+def trigrams(s: str) -> set:
+    return {s[j:j + 3] for j in range(len(s) - 2)}
 
 
 def to_int(x) -> Optional[int]:
@@ -67,132 +134,199 @@ class Song:
 
 # ---------- Index ----------
 class SongIndex:
+    # Normalized columns kept per song (see Song.normalized)
+    NORM_COLUMNS = ["title_n", "artist_n", "album_n", "key_n", "bpm_n", "path_n"]
+
     def __init__(self, items: List[Song]):
-        self.items: List[Song] = items
+        # Raw fields are stored column-wise; Song objects are only built for returned hits
+        self.columns: Dict[str, List[Any]] = {f: [getattr(s, f) for s in items] for f in FIELDS}
         # Precompute normalized fields and a combined searchable string
-        self.norms: List[Dict[str, str]] = []
-        self.search_texts: List[str] = []
-        for s in items:
-            n = s.normalized()
-            self.norms.append(n)
-            # Combined text for coarse candidate gen; keep small to save RAM
-            self.search_texts.append(" | ".join([n["title_n"], n["artist_n"], n["album_n"]]))
-
-    # Weighted fuzzy score across fields (like Fuse field weights)
-    def score(self, q: str, idx: int) -> float:
-        n = self.norms[idx]
-        w_title = 0.55
-        w_artist = 0.4
-        w_album = 0.05
-        # RapidFuzz scores are 0..100
-        s_title = fuzz.WRatio(q, n["title_n"]) if n["title_n"] else 0
-        s_artist = fuzz.WRatio(q, n["artist_n"]) if n["artist_n"] else 0
-        s_album = fuzz.WRatio(q, n["album_n"]) if n["album_n"] else 0
-        return w_title * s_title + w_artist * s_artist + w_album * s_album
-
-    # Simple query language: field:value, bpm:lo..hi, quoted phrases
-    def parse_query(self, query: str):
-        filters = {}
-        # bpm range e.g. bpm:120..130
-        m = re.search(r"\bbpm\s*:\s*(\d+)\s*\.\.\s*(\d+)", query, flags=re.I)
-        if m:
-            filters["bpm_range"] = (int(m.group(1)), int(m.group(2)))
-            query = re.sub(r"\bbpm\s*:\s*\d+\s*\.\.\s*\d+", "", query, flags=re.I)
-
-        # field:value pairs (artist:, title:, album:, key:, bpm:)
-        pairs = re.findall(r"\b(title|artist|album|key|bpm)\s*:\s*([^\s][^']*|'[^']*')", query, flags=re.I)
-        for f, v in pairs:
-            v = v.strip()
-            if v.startswith("'") and v.endswith("'"): v = v[1:-1]
-            filters[f.lower()] = norm(v) if f.lower() != "bpm" else v
-        if pairs:
-            # remove them from free-text
-            query = re.sub(r"\b(title|artist|album|key|bpm)\s*:\s*([^\s][^']*|'[^']*')", "", query, flags=re.I)
-
-        # exact phrase: 'once in a lifetime'
-        phrase = None
-        pm = re.search(r"'([^']+)'", query)
-        if pm: phrase = norm(pm.group(1)); query = re.sub(r"'[^']+'", "", query)
-
-        query = norm(query)
-        return query, phrase, filters
-
-    def filter_candidates(self, phrase: Optional[str], filters: Dict[str, Any]) -> List[int]:
-        cands = []
-        for i, n in enumerate(self.norms):
-            ok = True
-            # phrase must be in title or artist
-            if phrase:
-                if phrase not in n["title_n"] and phrase not in n["artist_n"]:
-                    ok = False
-            # field filters
-            if ok and "artist" in filters and filters["artist"] not in n["artist_n"]:
-                ok = False
-            if ok and "title" in filters and filters["title"] not in n["title_n"]:
-                ok = False
-            if ok and "album" in filters and filters["album"] not in n["album_n"]:
-                ok = False
-            if ok and "key" in filters:
-                # allow “am”, “a minor”, “A minor” → we normalized to short (e.g., am, c#, etc.)
-                keyq = filters["key"].replace(" major", "").replace(" minor", "m")
-                if keyq not in n["key_n"]:
-                    ok = False
-            if ok and "bpm" in filters:
-                if str(filters["bpm"]) != n["bpm_n"]:
-                    ok = False
-            if ok and "bpm_range" in filters:
-                lo, hi = filters["bpm_range"]
-                bpm_i = to_int(n["bpm_n"])
-                if bpm_i is None or bpm_i < lo or bpm_i > hi:
-                    ok = False
-            if ok:
-                cands.append(i)
+        norms = [s.normalized() for s in items]
+        self._set_norm_columns({c: [n[c] for n in norms] for c in self.NORM_COLUMNS})
+        # Combined text for coarse candidate gen; keep small to save RAM
+        self.search_texts: List[str] = [" | ".join([t, a, al]) for t, a, al in
+                                         zip(self.title_n, self.artist_n, self.album_n)]
+        self.bpm_i = np.fromiter((to_int(b) or -1 for b in self.bpm_n), dtype=np.int32, count=len(self.bpm_n))
+        # Built once here and saved with the index, so searches never pay for it;
+        # small indexes are scanned in full and don't need one
+        self._postings = self._build_postings() if len(self) >= TRIGRAM_MIN_SONGS else None
+
+    def _set_norm_columns(self, cols: Dict[str, List[str]]):
+        # Parallel per-field columns so filters only touch shortlisted indices
+        self.title_n: List[str] = cols["title_n"]
+        self.artist_n: List[str] = cols["artist_n"]
+        self.album_n: List[str] = cols["album_n"]
+        self.key_n: List[str] = cols["key_n"]
+        self.bpm_n: List[str] = cols["bpm_n"]
+        self.path_n: List[str] = cols["path_n"]
+
+    def __len__(self) -> int:
+        return len(self.search_texts)
+
+    def _build_postings(self) -> Dict[str, array]:
+        # trigram -> song indices whose search text contains it
+        postings = defaultdict(lambda: array("i"))
+        for i, text in enumerate(self.search_texts):
+            for t in trigrams(text):
+                postings[t].append(i)
+        return dict(postings)
+
+    def _trigram_postings(self) -> Dict[str, array]:
+        # Saved with pickled indexes; only legacy JSON indexes build it on first use
+        if self._postings is None:
+            self._postings = self._build_postings()
+        return self._postings
+
+    def trigram_candidates(self, q: str, k: int, min_size: int = 0) -> Optional[List[int]]:
+        """
+        Top-`k` songs by trigrams shared with `q` (at least 2 when `q` has 2+).
+        Returns None when prefiltering cannot help and the caller should scan everything:
+        small indexes (under TRIGRAM_MIN_SONGS), or fewer than `min_size` candidates.
+        """
+        if len(self) < TRIGRAM_MIN_SONGS or len(self) <= k:
+            return None
+        qgrams = trigrams(q)
+        if not qgrams:
+            return None
+        postings = self._trigram_postings()
+        hits = [postings[t] for t in qgrams if t in postings]
+        if not hits:
+            return None
+        counts = np.bincount(np.concatenate(hits), minlength=len(self))
+        need = min(2, len(qgrams))
+        # stable sort: songs tied on count keep index order, so the cut at `k`
+        # doesn't depend on set iteration order (i.e. PYTHONHASHSEED)
+        top = np.argsort(-counts, kind="stable")[:k]
+        # back in index order, so score ties break exactly as in a full scan
+        cands = np.sort(top[counts[top] >= need]).tolist()
+        # a pool smaller than the caller's shortlist would silently drop fuzzy matches
+        return cands if cands and len(cands) >= min_size else None
+
+    def song(self, i: int) -> Song:
+        """Materialize the Song at row `i`."""
+        return Song(**{f: self.columns[f][i] for f in FIELDS})
+
+    parse_query = staticmethod(parse_query)
+
+    def filter_candidates(self, phrase: Optional[str], filters: Mapping[str, Any],
+                          cand_idx: Optional[List[int]] = None) -> List[int]:
+        """Return the indices of `cand_idx` (default: all songs) passing phrase/field filters, in order."""
+        cands = list(range(len(self))) if cand_idx is None else list(cand_idx)
+        # phrase must be in title or artist
+        if phrase:
+            cands = [i for i in cands if phrase in self.title_n[i] or phrase in self.artist_n[i]]
+        # field filters
+        if "artist" in filters:
+            v = filters["artist"]
+            cands = [i for i in cands if v in self.artist_n[i]]
+        if "title" in filters:
+            v = filters["title"]
+            cands = [i for i in cands if v in self.title_n[i]]
+        if "album" in filters:
+            v = filters["album"]
+            cands = [i for i in cands if v in self.album_n[i]]
+        if "key" in filters:
+            # allow “am”, “a minor”, “A minor” (key:a minor or key:'a minor') → normalized to short (e.g., am, c#)
+            keyq = filters["key"].replace(" major", "").replace(" minor", "m")
+            cands = [i for i in cands if keyq in self.key_n[i]]
+        if "bpm" in filters:
+            v = str(filters["bpm"])
+            cands = [i for i in cands if self.bpm_n[i] == v]
+        if "bpm_range" in filters and cands:
+            lo, hi = filters["bpm_range"]
+            arr = np.asarray(cands, dtype=np.intp)
+            bpm = self.bpm_i[arr]
+            # missing bpm is stored as -1, so it never falls inside a range
+            cands = arr[(bpm >= lo) & (bpm <= hi)].tolist()
         return cands
 
     def search(self, query: str, limit: int = 10, threshold: float = 60.0) -> List[Tuple[Song, float]]:
-        q_free, phrase, filters = self.parse_query(query)
+        q_free, phrase, filters = parse_query(query)
 
         # Step 1: coarse candidate gen (if free text present)
         if q_free:
+            # Trigram prefilter so RapidFuzz only scans songs sharing text with the query
+            shortlist = max(100, limit * 10)
+            pool = self.trigram_candidates(q_free, max(500, limit * 20), min_size=shortlist)
+            texts = self.search_texts if pool is None else [self.search_texts[i] for i in pool]
             # RapidFuzz extract gives (text, score, index)
             # We just use it to shortlist indices, then rescore with field weights
-            ex = process.extract(q_free, self.search_texts, scorer=fuzz.WRatio, limit=max(100, limit * 10))
-            cand_idx = [idx for _, _, idx in ex]
+            ex = process.extract(q_free, texts, scorer=fuzz.WRatio, limit=shortlist)
+            cand_idx = [idx if pool is None else pool[idx] for _, _, idx in ex]
         else:
-            cand_idx = list(range(len(self.items)))
+            cand_idx = list(range(len(self)))
 
         # Step 2: apply filters (phrase, field filters, bpm)
-        cand_idx = [i for i in cand_idx if i in set(self.filter_candidates(phrase, filters))]
-
-        # Step 3: weighted rescore and sort
-        scored = []
-        for i in cand_idx:
-            s = self.score(q_free or self.norms[i]["title_n"], i)
-            if s >= threshold:
-                scored.append((i, s))
-        scored.sort(key=lambda x: x[1], reverse=True)
-        out = []
-        for i, s in scored[:limit]:
-            out.append((self.items[i], round(s, 2)))
-        return out
+        cand_idx = self.filter_candidates(phrase, filters, cand_idx)
+
+        # Step 3: weighted rescore (like Fuse field weights) and sort
+        if not cand_idx:
+            return []
+        titles = [self.title_n[i] for i in cand_idx]
+        artists = [self.artist_n[i] for i in cand_idx]
+        albums = [self.album_n[i] for i in cand_idx]
+        # RapidFuzz scores are 0..100; empty fields score 0
+        if q_free:
+            # one query against the whole shortlist, per field, in C++
+            s_title, s_artist, s_album = (
+                process.cdist([q_free], col, scorer=fuzz.WRatio, dtype=np.float64, workers=-1)[0]
+                for col in (titles, artists, albums))
+        else:
+            # no free text: each candidate is scored against its own title
+            s_title, s_artist, s_album = (
+                process.cpdist(titles, col, scorer=fuzz.WRatio, dtype=np.float64, workers=-1)
+                for col in (titles, artists, albums))
+        scores = 0.55 * s_title + 0.4 * s_artist + 0.05 * s_album
+
+        keep = np.flatnonzero(scores >= threshold)
+        order = keep[np.argsort(-scores[keep], kind="stable")[:limit]]
+        return [(self.song(cand_idx[j]), round(float(scores[j]), 2)) for j in order]
 
     # -------- persist/load --------
     def to_bytes(self) -> bytes:
+        # Columnar payload: one list per field. Pickle memoizes shared (interned)
+        # strings, so repeated artists/albums are stored once.
         payload = {
-            "items": [asdict(s) for s in self.items],
-            "norms": self.norms,
+            "format": INDEX_FORMAT,
+            **self.columns,
+            **{c: getattr(self, c) for c in self.NORM_COLUMNS},
+            "bpm_i": self.bpm_i,
             "search_texts": self.search_texts,
+            "postings": self._postings,
         }
-        return jdumps(payload)
+        b = pickle.dumps(payload, protocol=5)
+        return _zstd.ZstdCompressor(level=3).compress(b) if _zstd is not None else b
 
     @staticmethod
     def from_bytes(b: bytes) -> "SongIndex":
+        if b[:1] == b"{":
+            return SongIndex._from_json(b)
+        if b[:4] == ZSTD_MAGIC:
+            if _zstd is None:
+                raise RuntimeError("Index is zstd-compressed; install zstandard to load it.")
+            b = _zstd.ZstdDecompressor().decompress(b)
+        p = pickle.loads(b)
+        if p.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Unsupported index format {p.get('format')!r}; rebuild the index.")
+        idx = SongIndex.__new__(SongIndex)
+        # load precomputed columns as-is; no per-song objects
+        idx.columns = {f: p[f] for f in FIELDS}
+        idx._set_norm_columns(p)
+        idx.search_texts = p["search_texts"]
+        idx.bpm_i = p["bpm_i"]
+        idx._postings = p["postings"]
+        return idx
+
+    @staticmethod
+    def _from_json(b: bytes) -> "SongIndex":
+        # Legacy orjson index: {"items": [...], "norms": [...], "search_texts": [...]}
         p = jloads(b)
-        items = [Song(**d) for d in p["items"]]
-        idx = SongIndex(items)
-        # load precomputed to avoid recompute
-        idx.norms = p["norms"]
+        idx = SongIndex.__new__(SongIndex)
+        idx.columns = {f: [d.get(f, "") for d in p["items"]] for f in FIELDS}
+        idx._set_norm_columns({c: [n[c] for n in p["norms"]] for c in SongIndex.NORM_COLUMNS})
         idx.search_texts = p["search_texts"]
+        idx.bpm_i = np.fromiter((to_int(x) or -1 for x in idx.bpm_n), dtype=np.int32, count=len(idx.bpm_n))
+        idx._postings = None
         return idx
 
 
@@ -250,7 +384,7 @@ def main():
 
     ap_s = sub.add_parser("search", help="Search the index.")
     ap_s.add_argument("-x", "--index", required=True, help="Index file from 'build'.")
-    ap_s.add_argument("query", help="Query. Supports field:term, bpm:120..130, 'exact phrase'")
+    ap_s.add_argument("query", help="Query. Supports field:term (quote multi-word: artist:'bad bunny'), key:a minor, bpm:120..130, 'exact phrase'")
     ap_s.add_argument("-k", "--limit", type=int, default=10)
     ap_s.add_argument("-t", "--threshold", type=float, default=60.0, help="Score threshold 0..100")
     ap_s.set_defaults(func=cmd_search)
@@ -263,7 +397,8 @@ def search_index(query: str, limit: int = 10, threshold: float = 60.0, as_dict:
                  index_path: str = "songs.index"):
     """
     Convenience search helper.
-    - query: free text and/or filters (e.g., "artist:twice bpm:120..130 'once in a lifetime'")
+    - query: free text and/or filters (e.g., "artist:twice bpm:120..130 'once in a lifetime'");
+      multi-word field values must be quoted (artist:'bad bunny'), except key:a minor
     - limit: max results
     - threshold: 0..100 fuzzy score cutoff
     - as_dict: return list of dicts instead of (Song, score) tuples